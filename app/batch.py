@@ -0,0 +1,70 @@
+"""Batch question answering: one embedding pass, one vector query, bounded parallel generation."""
+from typing import AsyncIterator, Dict, List
+import asyncio
+import os
+from starlette.concurrency import run_in_threadpool
+from .llm import call_ollama_generate, get_embeddings, build_rag_prompt
+from .vectorstore import ChromaClientWrapper
+from .scheduler import get_scheduler
+
+# How many generations a single batch may run against Ollama at the same time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+# Most questions accepted in one batch request; all of them are embedded and searched in one go
+MAX_BATCH_QUERIES = int(os.environ.get("MAX_BATCH_QUERIES", 100))
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "gemma3:latest")
+
+
+async def run_batch(queries: List[str], db: ChromaClientWrapper, top_k: int = 4,
+                    concurrency: int = None, model: str = None, sources: List[str] = None,
+                    tags: List[str] = None) -> AsyncIterator[Dict]:
+    """Answer many questions, yielding one result dict per question as it completes.
+
+    Results arrive in completion order, so each carries the ``index`` of its
+    question in ``queries``. A failed generation is reported on its own result
+    (``error``) and does not abort the rest of the batch.
+    """
+    if not queries:
+        return
+    # BATCH_CONCURRENCY is the ceiling; callers may only ask for less
+    concurrency = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    model = model or OLLAMA_MODEL
+
+    print(f"--- Batch of {len(queries)} queries (concurrency={concurrency}) ---")
+    embeddings = await run_in_threadpool(get_embeddings, list(queries))
+    hits = await run_in_threadpool(db.similarity_search_by_embeddings, embeddings, top_k, sources, tags)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index: int, query: str, docs: List[Dict]) -> Dict:
+        result = {"type": "result", "index": index, "query": query, "sources": docs}
+        prompt = build_rag_prompt(query, [d["text"] for d in docs])
+        async with semaphore:
+            # share the global generation slots with interactive users, behind them in line
+            ticket = get_scheduler().reserve(batch=True)
+            try:
+                await ticket.acquire()
+                stream = call_ollama_generate(prompt, model, True)
+                worker = asyncio.ensure_future(run_in_threadpool(lambda: "".join(stream)))
+                try:
+                    result["answer"] = await asyncio.shield(worker)
+                except asyncio.CancelledError:
+                    # batch abandoned: stop the upstream request, and keep the slot until
+                    # the worker thread has really finished so the limit still holds
+                    if hasattr(stream, "close"):
+                        stream.close()
+                    await asyncio.wait([worker])
+                    raise
+            except Exception as e:
+                print(f"Batch generation failed for query {index}: {e}")
+                result["error"] = str(e)
+            finally:
+                ticket.release()
+        return result
+
+    tasks = [asyncio.ensure_future(answer(i, q, docs)) for i, (q, docs) in enumerate(zip(queries, hits))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for t in tasks:
+            t.cancel()
@@ -0,0 +1,123 @@
+"""Recall/latency tuning harness for the Chroma HNSW index.
+
+Ground truth is computed by brute force over the stored embeddings; each grid
+point is built in a throwaway in-memory Chroma client so the persisted
+collection is never touched.
+"""
+from itertools import product
+from typing import Dict, List
+import time
+import uuid
+import numpy as np
+
+
+def _distances(queries: np.ndarray, corpus: np.ndarray, space: str) -> np.ndarray:
+    # Same distance definitions Chroma's hnswlib uses for each space
+    if space == "cosine":
+        q = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+        c = corpus / np.clip(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12, None)
+        return 1.0 - q @ c.T
+    if space == "ip":
+        return 1.0 - queries @ corpus.T
+    if space == "l2":
+        return (queries ** 2).sum(1)[:, None] - 2.0 * queries @ corpus.T + (corpus ** 2).sum(1)[None, :]
+    raise ValueError(f"unsupported space: {space}")
+
+
+def exact_top_k(queries, corpus, k: int, space: str = "l2") -> np.ndarray:
+    """Indices of the exact k nearest corpus rows for each query (brute force)."""
+    queries = np.asarray(queries, dtype=np.float32)
+    corpus = np.asarray(corpus, dtype=np.float32)
+    k = min(k, len(corpus))
+    d = _distances(queries, corpus, space)
+    part = np.argpartition(d, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(d, part, axis=1).argsort(axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def recall_at_k(truth: List[List], found: List[List]) -> float:
+    """Mean fraction of the true top-k ids that the index returned."""
+    if not truth:
+        return 0.0
+    hits = [len(set(t) & set(f)) / len(t) for t, f in zip(truth, found) if len(t)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def parse_grid(spec: str) -> Dict[str, List]:
+    """Parse "M=8,16 construction_ef=100,200 search_ef=10,50" into a grid dict."""
+    grid = {}
+    for part in spec.split():
+        name, _, values = part.partition("=")
+        grid[name] = [v if name == "space" else int(v) for v in values.split(",") if v]
+    return grid
+
+
+def run_grid(ids: List[str], embeddings, grid: Dict[str, List], k: int = 4,
+             n_queries: int = 100, queries=None, space: str = "l2", seed: int = 0) -> List[Dict]:
+    """Build an index per grid point and report recall@k against query latency.
+
+    When ``queries`` is not given, ``n_queries`` stored embeddings are sampled
+    and used as queries. Returns one row per setting with build time, mean and
+    p95 per-query latency (ms) and recall@k.
+    """
+    import chromadb
+
+    corpus = np.asarray(embeddings, dtype=np.float32)
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        pick = rng.choice(len(corpus), size=min(n_queries, len(corpus)), replace=False)
+        queries = corpus[pick]
+    queries = np.asarray(queries, dtype=np.float32)
+
+    rows = []
+    spaces = grid.get("space") or [space]
+    names = [n for n in ("M", "construction_ef", "search_ef") if grid.get(n)]
+    client = chromadb.EphemeralClient()
+    for sp in spaces:
+        truth_idx = exact_top_k(queries, corpus, k, sp)
+        truth = [[ids[i] for i in row] for row in truth_idx]
+        for values in product(*(grid[n] for n in names)):
+            params = dict(zip(names, values), space=sp)
+            rows.append(_measure(client, ids, corpus, queries, truth, params, k))
+    return rows
+
+
+def _measure(client, ids, corpus, queries, truth, params: Dict, k: int) -> Dict:
+    from .vectorstore import hnsw_metadata
+
+    name = f"tune_{uuid.uuid4().hex[:8]}"
+    collection = client.create_collection(name, metadata=hnsw_metadata(params))
+    try:
+        start = time.perf_counter()
+        for s in range(0, len(ids), 1000):
+            collection.add(ids=ids[s:s + 1000], embeddings=corpus[s:s + 1000].tolist())
+        build_s = time.perf_counter() - start
+
+        found, latencies = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            res = collection.query(query_embeddings=[q.tolist()], n_results=k, include=[])
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            found.append(res["ids"][0])
+    finally:
+        client.delete_collection(name)
+
+    row = dict(params)
+    row.update({
+        "build_s": round(build_s, 3),
+        "latency_ms_mean": round(float(np.mean(latencies)), 3),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+        f"recall@{k}": round(recall_at_k(truth, found), 4),
+    })
+    return row
+
+
+def format_report(rows: List[Dict]) -> str:
+    if not rows:
+        return "(no results)"
+    cols = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in cols}
+    lines = ["  ".join(c.ljust(widths[c]) for c in cols)]
+    for r in rows:
+        lines.append("  ".join(str(r.get(c, "")).ljust(widths[c]) for c in cols))
+    return "\n".join(lines)
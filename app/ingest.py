@@ -1,11 +1,23 @@
 """Reusable ingestion helpers for PDFs: extract, chunk, embed, upsert to Chroma."""
 from pathlib import Path
 from typing import List
-from .vectorstore import ChromaClientWrapper
+from .vectorstore import ChromaClientWrapper, tag_metadata
 from .llm import get_embeddings
 import tempfile
+import hashlib
+import uuid
 import os
 import requests
+import anyio
+import anyio.to_thread
+
+# Upload limits; override via environment variables.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
 
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
@@ -25,7 +37,8 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[st
     return chunks
 
 
-def ingest_pdf_file(pdf_path: Path, persist_directory: str = "./chroma_db", source_name: str = None) -> int:
+def ingest_pdf_file(pdf_path: Path, persist_directory: str = "./chroma_db", source_name: str = None,
+                    tags: List[str] = None) -> int:
     display_name = source_name or pdf_path.name
     print(f"Starting ingestion for {display_name} (local: {pdf_path})")
     # extract text using pdftomd.py's helper
@@ -45,8 +58,9 @@ def ingest_pdf_file(pdf_path: Path, persist_directory: str = "./chroma_db", sour
     print(f"Generated embeddings for {len(chunks)} chunks. Upserting to vector store...")
 
     docs = []
+    extra = tag_metadata(tags)
     for i, (c, emb) in enumerate(zip(chunks, embeddings)):
-        docs.append({"id": f"{display_name}-{i}", "text": c, "metadata": {"source": display_name, "chunk": i}})
+        docs.append({"id": f"{display_name}-{i}", "text": c, "metadata": {"source": display_name, "chunk": i, **extra}})
 
     db = ChromaClientWrapper(persist_directory=persist_directory)
     db.upsert_documents(docs, embeddings=embeddings)
@@ -54,7 +68,7 @@ def ingest_pdf_file(pdf_path: Path, persist_directory: str = "./chroma_db", sour
     return len(docs)
 
 
-def ingest_pdf_from_url(url: str, persist_directory: str = "./chroma_db") -> int:
+def ingest_pdf_from_url(url: str, persist_directory: str = "./chroma_db", tags: List[str] = None) -> int:
     # download to temp file
     # support file:// URLs or local absolute paths
     if url.startswith("file://"):
@@ -63,11 +77,11 @@ def ingest_pdf_from_url(url: str, persist_directory: str = "./chroma_db") -> int
         if local.startswith('/') and len(local) > 2 and local[2] == ':':
             local = local[1:]
         local_path = Path(local)
-        return ingest_pdf_file(local_path, persist_directory=persist_directory)
+        return ingest_pdf_file(local_path, persist_directory=persist_directory, tags=tags)
 
     # Windows absolute path (e.g. C:\... or D:/...)
     if Path(url).exists():
-        return ingest_pdf_file(Path(url), persist_directory=persist_directory)
+        return ingest_pdf_file(Path(url), persist_directory=persist_directory, tags=tags)
 
     resp = requests.get(url, stream=True, timeout=30)
     resp.raise_for_status()
@@ -78,10 +92,48 @@ def ingest_pdf_from_url(url: str, persist_directory: str = "./chroma_db") -> int
         tmp_path = Path(tmp.name)
 
     try:
-        count = ingest_pdf_file(tmp_path, persist_directory=persist_directory)
+        count = ingest_pdf_file(tmp_path, persist_directory=persist_directory, tags=tags)
     finally:
         try:
             os.unlink(tmp_path)
         except Exception:
             pass
     return count
+
+
+async def save_upload_stream(upload, dest_dir: Path, filename: str, max_bytes: int = None,
+                             chunk_size: int = None):
+    """Stream an UploadFile to dest_dir/filename in chunks, hashing as we copy.
+
+    Data is written to a hidden ``.part`` file next to the destination and
+    renamed into place only once the copy finished, so readers never see a
+    half-written PDF. Returns ``(path, size, sha256_hex)``.
+    """
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    final_path = dest_dir / filename
+    tmp_path = dest_dir / f".{filename}.{uuid.uuid4().hex}.part"
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLargeError(f"upload exceeds limit of {max_bytes} bytes")
+                digest.update(chunk)
+                await out.write(chunk)
+        await anyio.to_thread.run_sync(os.replace, tmp_path, final_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return final_path, size, digest.hexdigest()
@@ -1,34 +1,82 @@
 """LLM and embeddings wrappers for Ollama (local) with a sentence-transformers fallback."""
 from typing import List
+from pathlib import Path
 import os
 import json
 from dotenv import load_dotenv
-import requests
 
 load_dotenv()
 
-OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+from .ollama_client import CircuitBreaker, BackendUnavailableError, get_ollama_client, is_backend_failure
+
+# Ollama embedding requests are split into sub-batches of at most this many texts
+OLLAMA_EMBED_BATCH_SIZE = int(os.environ.get("OLLAMA_EMBED_BATCH_SIZE", 32))
+
+# Separate breakers so e.g. a model without embedding support can't take generation down
+ollama_generate_breaker = CircuitBreaker("ollama-generate", probe=lambda: get_ollama_client().ping(),
+                                         is_failure=is_backend_failure)
+ollama_embed_breaker = CircuitBreaker("ollama-embeddings", probe=lambda: get_ollama_client().ping(),
+                                      is_failure=is_backend_failure)
+
+
+class OllamaStream:
+    """Iterable of generated tokens whose upstream request can be cancelled from another thread.
+
+    Iterating blocks on the Ollama response, so callers normally drive it from a
+    worker thread; ``close()`` shuts the socket down so that blocked read
+    returns at once and Ollama stops generating for this request.
+    """
+
+    def __init__(self, client, payload):
+        self._client = client
+        self._payload = payload
+        self._resp = None
+        self.closed = False
+
+    def __iter__(self):
+        if self.closed:
+            return
+        resp = ollama_generate_breaker.call(self._client.generate, self._payload, stream=True)
+        self._resp = resp
+        if self.closed:
+            resp.close()
+            return
+        with resp:
+            for line in resp.iter_lines():
+                if self.closed:
+                    break
+                if line:
+                    chunk = json.loads(line)
+                    if "response" in chunk:
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        break
+
+    def close(self):
+        # safe to call twice; a response left unset here is closed by __iter__ instead
+        if self.closed:
+            return
+        self.closed = True
+        resp = self._resp
+        if resp is None:
+            return
+        shutdown = getattr(resp.raw, "shutdown", None)  # urllib3>=2.3
+        try:
+            if shutdown:
+                shutdown()
+            resp.close()
+        except Exception as e:
+            print(f"Error closing Ollama stream: {e}")
 
 
 def call_ollama_generate(prompt: str, model: str = "gemma3:latest", stream: bool = False):
-    url = f"{OLLAMA_URL}/api/generate"
+    client = get_ollama_client()
     payload = {"model": model, "prompt": prompt, "stream": stream}
     print(payload)
     if stream:
-        def generator():
-            with requests.post(url, json=payload, stream=True, timeout=60) as resp:
-                resp.raise_for_status()
-                for line in resp.iter_lines():
-                    if line:
-                        chunk = json.loads(line)
-                        if "response" in chunk:
-                            yield chunk["response"]
-                        if chunk.get("done"):
-                            break
-        return generator()
+        return OllamaStream(client, payload)
     else:
-        resp = requests.post(url, json=payload, timeout=60)
-        resp.raise_for_status()
+        resp = ollama_generate_breaker.call(client.generate, payload)
         # If it was returned as a stream of JSONs (default Ollama behavior if stream not specified or True)
         # We need to concatenate them if they came back as multiple lines
         full_response = ""
@@ -44,15 +92,40 @@ def call_ollama_generate(prompt: str, model: str = "gemma3:latest", stream: bool
         return full_response
 
 
+def build_rag_prompt(query: str, context_texts: List[str], history_context: str = "") -> str:
+    """Assemble the grounded-answer prompt from retrieved chunks and chat history."""
+    prompt = f"""
+You are a helpful knowledge assistant. Answer the user's question ONLY using the provided Context and Conversation History below.
+If the context does not contain the answer, politely state that you don't have enough information based on the documents.
+Always cite the context index [1], [2], etc., when you use information from it.
+
+Conversation History:
+{history_context}
+
+Context Information:
+"""
+    for i, t in enumerate(context_texts, start=1):
+        prompt += f"\n[Context {i}]\n{t}\n"
+
+    prompt += f"\nUser question: {query}\n\nHelpful Answer:"
+    return prompt
+
+
 def call_ollama_embeddings(texts: List[str], model: str = "gemma3:latest") -> List[List[float]]:
     if not texts:
         return []
-    url = f"{OLLAMA_URL}/api/embeddings"
-    payload = {"model": model, "input": texts}
     print(f"Requesting embeddings from Ollama for {len(texts)} texts...")
-    resp = requests.post(url, json=payload, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+    embeddings = []
+    for start in range(0, len(texts), OLLAMA_EMBED_BATCH_SIZE):
+        batch = texts[start:start + OLLAMA_EMBED_BATCH_SIZE]
+        embeddings.extend(_ollama_embed_batch(batch, model))
+    print(f"Successfully retrieved {len(embeddings)} vectors.")
+    return embeddings
+
+
+def _ollama_embed_batch(texts: List[str], model: str) -> List[List[float]]:
+    payload = {"model": model, "input": texts}
+    data = ollama_embed_breaker.call(get_ollama_client().embeddings, payload)
     
     # Ensure result is always a list of lists
     embeddings = []
@@ -79,8 +152,6 @@ def call_ollama_embeddings(texts: List[str], model: str = "gemma3:latest") -> Li
         
     if not embeddings:
         raise RuntimeError(f"Could not extract embeddings from Ollama response: {data}")
-        
-    print(f"Successfully retrieved {len(embeddings)} vectors.")
     return embeddings
 
 
@@ -95,14 +166,79 @@ def embed_with_sentence_transformer(text: str) -> List[float]:
     return vec.tolist()
 
 
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# "torch" (default), "onnx" or "onnx-int8" (dynamically quantized ONNX)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+EMBEDDING_ONNX_DIR = os.environ.get("EMBEDDING_ONNX_DIR", f"./models/{EMBEDDING_MODEL}-onnx")
+# arm64, avx2, avx512 or avx512_vnni; pick the one matching the server CPU
+EMBEDDING_QUANT_CONFIG = os.environ.get("EMBEDDING_QUANT_CONFIG", "avx2")
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", 0)) or None
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+
 _model_cache = {}
 
+
+def _onnx_session_options():
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    if EMBEDDING_THREADS:
+        so.intra_op_num_threads = EMBEDDING_THREADS
+        so.inter_op_num_threads = 1
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return so
+
+
+def load_embedding_model(backend: str = None):
+    """Load the embedding model for a backend: "torch", "onnx" or "onnx-int8".
+
+    The ONNX export (and int8 quantization) is done once and saved under
+    EMBEDDING_ONNX_DIR, so later starts load the exported graph directly.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "torch":
+        if EMBEDDING_THREADS:
+            import torch
+            torch.set_num_threads(EMBEDDING_THREADS)
+        return SentenceTransformer(EMBEDDING_MODEL)
+
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"unknown embedding backend: {backend}")
+
+    onnx_dir = Path(EMBEDDING_ONNX_DIR)
+    if not (onnx_dir / "onnx" / "model.onnx").exists():
+        print(f"Exporting {EMBEDDING_MODEL} to ONNX at {onnx_dir}...")
+        SentenceTransformer(EMBEDDING_MODEL, backend="onnx").save_pretrained(str(onnx_dir))
+
+    file_name = "onnx/model.onnx"
+    if backend == "onnx-int8":
+        file_name = f"onnx/model_qint8_{EMBEDDING_QUANT_CONFIG}.onnx"
+        if not (onnx_dir / file_name).exists():
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            print(f"Quantizing ONNX model to int8 ({EMBEDDING_QUANT_CONFIG})...")
+            base = SentenceTransformer(str(onnx_dir), backend="onnx", model_kwargs={"file_name": "onnx/model.onnx"})
+            export_dynamic_quantized_onnx_model(base, EMBEDDING_QUANT_CONFIG, str(onnx_dir))
+
+    return SentenceTransformer(
+        str(onnx_dir),
+        backend="onnx",
+        model_kwargs={"file_name": file_name, "provider": "CPUExecutionProvider",
+                      "session_options": _onnx_session_options()},
+    )
+
+
 def get_sentence_transformer_model():
     if "model" not in _model_cache:
         try:
-            from sentence_transformers import SentenceTransformer
-            print("Loading open-source embedding model (all-MiniLM-L6-v2)...")
-            _model_cache["model"] = SentenceTransformer("all-MiniLM-L6-v2")
+            print(f"Loading open-source embedding model ({EMBEDDING_MODEL}, backend={EMBEDDING_BACKEND})...")
+            try:
+                _model_cache["model"] = load_embedding_model(EMBEDDING_BACKEND)
+            except Exception as e:
+                if EMBEDDING_BACKEND == "torch":
+                    raise
+                print(f"ONNX embedding backend unavailable: {e}. Using PyTorch model.")
+                _model_cache["model"] = load_embedding_model("torch")
             print("Model loaded successfully.")
         except Exception as e:
             print(f"Error loading sentence-transformers: {e}")
@@ -110,25 +246,44 @@ def get_sentence_transformer_model():
     return _model_cache.get("model")
 
 
+def _probe_sentence_transformer():
+    model = get_sentence_transformer_model()
+    if model is None:
+        raise RuntimeError("embedding model could not be loaded")
+    model.encode(["ping"])
+
+
+st_breaker = CircuitBreaker("sentence-transformers", probe=_probe_sentence_transformer)
+
+
+def _encode_with_sentence_transformer(texts: List[str]) -> List[List[float]]:
+    model = get_sentence_transformer_model()
+    if model is None:
+        raise RuntimeError("sentence-transformers model not available")
+    # encode() sorts inputs by length before batching, which keeps padding per batch low
+    vecs = model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE)
+    return [v.tolist() for v in vecs]
+
+
 def get_embeddings(texts: List[str]) -> List[List[float]]:
     """Get embeddings using open-source sentence-transformers (default)
-    with Ollama as a fallback.
+    with Ollama as a fallback. Backends whose circuit breaker is open are skipped.
     """
     if not texts:
         return []
 
     # Try open-source model first as requested
-    model = get_sentence_transformer_model()
-    if model:
+    if st_breaker.allow():
         try:
-            vecs = model.encode(texts)
-            return [v.tolist() for v in vecs]
+            return st_breaker.call(_encode_with_sentence_transformer, texts)
         except Exception as e:
             print(f"Sentence-transformers encoding failed: {e}. Falling back to Ollama.")
 
     # Fallback to Ollama
     try:
         return call_ollama_embeddings(texts)
+    except BackendUnavailableError:
+        raise BackendUnavailableError("no embedding backend available (sentence-transformers and Ollama both unhealthy)")
     except Exception as e:
         print(f"Ollama embedding also failed: {e}")
         raise
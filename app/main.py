@@ -1,19 +1,62 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 from pathlib import Path
-from .llm import call_ollama_generate, get_embeddings
-from .ingest import ingest_pdf_from_url, ingest_pdf_file
+import asyncio
+from .llm import call_ollama_generate, get_embeddings, build_rag_prompt, ollama_generate_breaker, ollama_embed_breaker, st_breaker
+from .ingest import ingest_pdf_from_url, ingest_pdf_file, save_upload_stream, UploadTooLargeError, MAX_UPLOAD_BYTES
 from .vectorstore import ChromaClientWrapper
+from .batch import run_batch, BATCH_CONCURRENCY, MAX_BATCH_QUERIES
+from .scheduler import get_scheduler, QueueFullError
+from typing import List, Optional
 
 app = FastAPI(title="Usecase RAG API")
 
 DB_DIR = Path("./chroma_db")
 db = ChromaClientWrapper(persist_directory=str(DB_DIR))
 
+# Allowance for multipart boundaries and part headers on top of the file itself
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """Reject oversized uploads from the Content-Length header, before the body is read.
+
+    Starlette parses (and spools) the whole multipart body before the endpoint
+    runs, so this check has to happen at the ASGI layer to save the transfer.
+    Plain ASGI rather than BaseHTTPMiddleware so streaming responses and
+    disconnect detection on other routes are unaffected.
+    """
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path and MAX_UPLOAD_BYTES:
+            for name, value in scope.get("headers", []):
+                if name != b"content-length":
+                    continue
+                try:
+                    length = int(value)
+                except ValueError:
+                    break
+                if length > MAX_UPLOAD_BYTES + UPLOAD_MULTIPART_OVERHEAD:
+                    response = JSONResponse({"detail": f"file exceeds limit of {MAX_UPLOAD_BYTES} bytes"},
+                                            status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware, path="/api/ingest/upload")
+
 # Allow local frontend during development
 app.add_middleware(
     CORSMiddleware,
@@ -32,6 +75,19 @@ class QueryRequest(BaseModel):
     query: str
     top_k: int = 4
     session_id: str = "default_session"
+    # Optional scope: only chunks from these documents / carrying any of these tags
+    sources: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+
+
+class BatchQueryRequest(BaseModel):
+    # bounded so one request can't embed and search an unlimited number of questions at once
+    queries: List[str] = Field(..., max_length=MAX_BATCH_QUERIES)
+    top_k: int = 4
+    # capped server-side so one batch can't take over every generation slot
+    concurrency: Optional[int] = Field(None, ge=1, le=BATCH_CONCURRENCY)
+    sources: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
 
 
 @app.get("/api/status")
@@ -40,12 +96,18 @@ def status():
         "status": "ok", 
         "model_endpoint": "http://localhost:11434", 
         "chroma_persist": str(DB_DIR),
-        "redis_connected": history_manager.enabled
+        "redis_connected": history_manager.enabled,
+        "backends": {
+            "ollama_generate": "unhealthy" if ollama_generate_breaker.is_open else "ok",
+            "ollama_embeddings": "unhealthy" if ollama_embed_breaker.is_open else "ok",
+            "sentence_transformers": "unhealthy" if st_breaker.is_open else "ok",
+        },
+        "generation": get_scheduler().stats()
     }
 
 
 @app.post("/api/query")
-async def query(req: QueryRequest):
+async def query(req: QueryRequest, request: Request):
     if not req.query:
         raise HTTPException(status_code=400, detail="query is required")
 
@@ -57,9 +119,19 @@ async def query(req: QueryRequest):
     for msg in history:
         history_context += f"{msg['role'].capitalize()}: {msg['content']}\n"
 
+    # Admission control: take a generation slot or a queue place, or turn the client away
+    try:
+        ticket = get_scheduler().reserve()
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
     # compute embedding
-    q_emb = get_embeddings([req.query])[0]
-    docs = db.similarity_search_by_embedding(q_emb, top_k=req.top_k)
+    try:
+        q_emb = get_embeddings([req.query])[0]
+        docs = db.similarity_search_by_embedding(q_emb, top_k=req.top_k, sources=req.sources, tags=req.tags)
+    except Exception:
+        ticket.release()
+        raise
     
     print(f"Retrieved {len(docs)} chunks from vector store.")
     if docs:
@@ -68,40 +140,71 @@ async def query(req: QueryRequest):
         print("WARNING: No relevant chunks retrieved!")
 
     context_texts = [d["text"] for d in docs]
-    prompt = f"""
-You are a helpful knowledge assistant. Answer the user's question ONLY using the provided Context and Conversation History below.
-If the context does not contain the answer, politely state that you don't have enough information based on the documents.
-Always cite the context index [1], [2], etc., when you use information from it.
-
-Conversation History:
-{history_context}
-
-Context Information:
-"""
-    for i, t in enumerate(context_texts, start=1):
-        prompt += f"\n[Context {i}]\n{t}\n"
-    
-    prompt += f"\nUser question: {req.query}\n\nHelpful Answer:"
+    prompt = build_rag_prompt(req.query, context_texts, history_context)
 
     # Use streaming
     from fastapi.responses import StreamingResponse
     import json
 
     async def stream_generator():
-        # First yield the sources as a JSON line
-        yield json.dumps({"type": "sources", "data": docs}) + "\n"
-        
         full_answer = ""
+        stream = None
+        watcher = None
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            # Wait on the ASGI channel itself so a disconnect is seen at once, even
+            # while the worker thread is still blocked waiting for the first token
+            while (await request.receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            print("Client disconnected; cancelling generation.")
+            if hasattr(stream, "close"):
+                stream.close()
+
         try:
-            gen = call_ollama_generate(prompt, model="gemma3:latest", stream=True)
-            for chunk in gen:
-                if chunk:
-                    full_answer += chunk
-                    yield json.dumps({"type": "chunk", "data": chunk}) + "\n"
-        except Exception as e:
-            print(f"Streaming error: {e}")
-            yield json.dumps({"type": "chunk", "data": f"\n[Error: {str(e)}]"}) + "\n"
-            
+            # First yield the sources as a JSON line
+            yield json.dumps({"type": "sources", "data": docs}) + "\n"
+
+            # Report our place in line until a generation slot frees up
+            last_position = None
+            async for position in ticket.wait():
+                if await request.is_disconnected():
+                    print("Client disconnected while queued.")
+                    return
+                if position != last_position:
+                    last_position = position
+                    yield json.dumps({"type": "queued", "position": position}) + "\n"
+
+            try:
+                stream = call_ollama_generate(prompt, model="gemma3:latest", stream=True)
+                watcher = asyncio.ensure_future(watch_disconnect())
+                tokens = iter(stream)
+                # Pull tokens on a worker thread so a slow upstream never blocks the event loop
+                while True:
+                    chunk = await run_in_threadpool(next, tokens, None)
+                    if disconnected.is_set():
+                        return
+                    if chunk is None:
+                        break
+                    if chunk:
+                        full_answer += chunk
+                        yield json.dumps({"type": "chunk", "data": chunk}) + "\n"
+            except Exception as e:
+                if disconnected.is_set():
+                    # the read was cut short by close(); nobody is listening for an error
+                    return
+                print(f"Streaming error: {e}")
+                yield json.dumps({"type": "chunk", "data": f"\n[Error: {str(e)}]"}) + "\n"
+        finally:
+            # Runs on completion, disconnect and cancellation alike: drop the upstream
+            # request and hand the slot to the next waiter
+            if watcher is not None:
+                watcher.cancel()
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            ticket.release()
+
         # Finally save to history
         if full_answer:
             history_manager.save_message(req.session_id, "user", req.query)
@@ -112,6 +215,29 @@ Context Information:
     return StreamingResponse(stream_generator(), media_type="application/x-ndjson")
 
 
+@app.post("/api/query/batch")
+async def query_batch(req: BatchQueryRequest):
+    queries = req.queries
+    if not queries or not all(q and q.strip() for q in queries):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list of questions")
+
+    from fastapi.responses import StreamingResponse
+    import json
+
+    async def stream_generator():
+        # One NDJSON line per answer, in completion order
+        try:
+            async for result in run_batch(queries, db, top_k=req.top_k, concurrency=req.concurrency,
+                                          sources=req.sources, tags=req.tags):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"Batch query error: {e}")
+            yield json.dumps({"type": "error", "data": str(e)}) + "\n"
+        yield json.dumps({"type": "done", "count": len(queries)}) + "\n"
+
+    return StreamingResponse(stream_generator(), media_type="application/x-ndjson")
+
+
 @app.post("/api/ingest")
 def ingest(payload: dict):
     # Accept JSON {"url": "https://..."} to fetch a PDF and ingest it.
@@ -120,7 +246,7 @@ def ingest(payload: dict):
         raise HTTPException(status_code=400, detail="url is required in JSON body")
 
     try:
-        count = ingest_pdf_from_url(url, persist_directory=str(DB_DIR))
+        count = ingest_pdf_from_url(url, persist_directory=str(DB_DIR), tags=payload.get("tags"))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ingest failed: {e}")
     return {"status": "ok", "ingested_chunks": count}
@@ -137,41 +263,50 @@ def reset_db():
 
 
 @app.post("/api/ingest/upload")
-async def ingest_upload(file: UploadFile = File(...)):
+async def ingest_upload(file: UploadFile = File(...), tags: Optional[str] = Form(None)):
+    # tags: optional comma-separated labels used to scope /api/query
     # Accept uploaded PDF file
     if not file.filename:
         raise HTTPException(status_code=400, detail="file required")
 
     from datetime import datetime
-    import os
-    
-    # Create uploaded_files dir if not exists
+
+    # Only keep the base name so a crafted filename can't escape the upload dir
+    filename = Path(file.filename).name
+    if not filename:
+        raise HTTPException(status_code=400, detail="file required")
+
+    # Stream to persistent storage in chunks (temp file + atomic rename). Oversized
+    # requests with a Content-Length are already turned away by UploadSizeLimitMiddleware;
+    # this copy enforces the limit again for chunked uploads.
     UPLOAD_DIR = Path("uploaded_files")
-    UPLOAD_DIR.mkdir(exist_ok=True)
-    
-    # Save file to persistent storage
-    file_path = UPLOAD_DIR / file.filename
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    file_size = len(content)
+    try:
+        file_path, file_size, sha256 = await save_upload_stream(file, UPLOAD_DIR, filename)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        await file.close()
+
     timestamp = datetime.now().isoformat()
 
     try:
         # 1. Save file-level metadata to Chroma
-        db.save_file_metadata(file.filename, file_size, timestamp)
+        tag_list = [t.strip() for t in (tags or "").split(",") if t.strip()]
+        db.save_file_metadata(filename, file_size, timestamp, sha256=sha256, tags=tag_list)
         
-        # 2. Ingest the file (chunking, embedding, upserting chunks)
-        count = ingest_pdf_file(file_path, persist_directory=str(DB_DIR), source_name=file.filename)
+        # 2. Ingest the file from disk off the event loop (chunking, embedding, upserting chunks)
+        count = await run_in_threadpool(ingest_pdf_file, file_path, persist_directory=str(DB_DIR), source_name=filename,
+                                        tags=tag_list)
         
         return {
             "status": "ok", 
             "ingested_chunks": count, 
             "file_info": {
-                "name": file.filename,
+                "name": filename,
                 "size": file_size,
-                "timestamp": timestamp
+                "timestamp": timestamp,
+                "sha256": sha256,
+                "tags": tag_list
             }
         }
     except Exception as e:
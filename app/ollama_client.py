@@ -0,0 +1,169 @@
+"""Shared HTTP client for Ollama plus a circuit breaker for flaky backends."""
+from typing import Callable, Dict, Optional
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", 10))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 3))
+OLLAMA_GENERATE_TIMEOUT = float(os.environ.get("OLLAMA_GENERATE_TIMEOUT", 60))
+OLLAMA_EMBED_TIMEOUT = float(os.environ.get("OLLAMA_EMBED_TIMEOUT", 30))
+OLLAMA_PROBE_TIMEOUT = float(os.environ.get("OLLAMA_PROBE_TIMEOUT", 2))
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", 2))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", 0.5))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 3))
+BREAKER_PROBE_INTERVAL = float(os.environ.get("BREAKER_PROBE_INTERVAL", 15))
+
+
+class BackendUnavailableError(RuntimeError):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Remember that a backend is unhealthy and skip it until a probe succeeds.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``allow()`` returns False. A daemon thread then calls ``probe`` every
+    ``probe_interval`` seconds and closes the breaker on the first success, so
+    requests never pay for a backend that is known to be down.
+    """
+
+    def __init__(self, name: str, probe: Callable[[], object], failure_threshold: int = None,
+                 probe_interval: float = None, is_failure: Callable[[Exception], bool] = None):
+        self.name = name
+        self.probe = probe
+        # decides which exceptions mean "backend unhealthy"; default: all of them
+        self.is_failure = is_failure
+        self.failure_threshold = failure_threshold or BREAKER_FAILURE_THRESHOLD
+        self.probe_interval = BREAKER_PROBE_INTERVAL if probe_interval is None else probe_interval
+        self.failures = 0
+        self.is_open = False
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def allow(self) -> bool:
+        return not self.is_open
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.is_open or self.failures < self.failure_threshold:
+                return
+            self.is_open = True
+            print(f"Circuit breaker '{self.name}' opened after {self.failures} failures.")
+            self._prober = threading.Thread(target=self._probe_loop, name=f"probe-{self.name}", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while self.is_open:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+            except Exception as e:
+                print(f"Probe for '{self.name}' failed: {e}")
+                continue
+            with self._lock:
+                self.is_open = False
+                self.failures = 0
+            print(f"Circuit breaker '{self.name}' closed; backend healthy again.")
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Run fn through the breaker, recording the outcome."""
+        if not self.allow():
+            raise BackendUnavailableError(f"{self.name} is marked unhealthy; skipping")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure is None or self.is_failure(e):
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def is_backend_failure(exc: Exception) -> bool:
+    """Transport errors, timeouts and 5xx mean Ollama is unhealthy; 4xx are caller errors."""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500
+    return False
+
+
+def _is_retryable(exc: Exception, operation: str) -> bool:
+    if operation == "generate":
+        # a read timeout already cost a full OLLAMA_GENERATE_TIMEOUT; only retry when
+        # the request never reached Ollama (ConnectTimeout is a ConnectionError too)
+        return isinstance(exc, requests.ConnectionError)
+    return is_backend_failure(exc)
+
+
+class OllamaClient:
+    """Pooled Ollama HTTP client with per-operation timeouts and jittered retries."""
+
+    def __init__(self, base_url: str = None, pool_size: int = None, retries: int = None):
+        self.base_url = (base_url or OLLAMA_URL).rstrip("/")
+        self.retries = OLLAMA_RETRIES if retries is None else retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size or OLLAMA_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeouts = {
+            "generate": (OLLAMA_CONNECT_TIMEOUT, OLLAMA_GENERATE_TIMEOUT),
+            "embeddings": (OLLAMA_CONNECT_TIMEOUT, OLLAMA_EMBED_TIMEOUT),
+            "probe": (OLLAMA_CONNECT_TIMEOUT, OLLAMA_PROBE_TIMEOUT),
+        }
+
+    def _post(self, path: str, payload: Dict, operation: str, stream: bool = False) -> requests.Response:
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.post(f"{self.base_url}{path}", json=payload, stream=stream,
+                                         timeout=self.timeouts[operation])
+                try:
+                    resp.raise_for_status()
+                except Exception:
+                    # hand a streamed connection back to the pool before retrying / raising
+                    resp.close()
+                    raise
+                return resp
+            except Exception as e:
+                if attempt >= self.retries or not _is_retryable(e, operation):
+                    raise
+                # full jitter: sleep somewhere in [0, backoff * 2^attempt]
+                delay = random.uniform(0, OLLAMA_RETRY_BACKOFF * (2 ** attempt))
+                print(f"Ollama {operation} failed ({e}); retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def generate(self, payload: Dict, stream: bool = False) -> requests.Response:
+        """POST /api/generate. With stream=True the caller must close the response."""
+        return self._post("/api/generate", payload, "generate", stream=stream)
+
+    def embeddings(self, payload: Dict) -> Dict:
+        return self._post("/api/embeddings", payload, "embeddings").json()
+
+    def ping(self):
+        resp = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeouts["probe"])
+        resp.raise_for_status()
+
+
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_ollama_client() -> OllamaClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaClient()
+    return _client
@@ -0,0 +1,129 @@
+"""Admission control for LLM generation: a concurrency limit plus a bounded FIFO wait queue."""
+from collections import deque
+from typing import AsyncIterator, Optional
+import asyncio
+import os
+
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("MAX_CONCURRENT_GENERATIONS", 2))
+MAX_QUEUED_GENERATIONS = int(os.environ.get("MAX_QUEUED_GENERATIONS", 16))
+# Seconds a rejected client is told to wait before retrying
+GENERATION_RETRY_AFTER = int(os.environ.get("GENERATION_RETRY_AFTER", 10))
+# How often a queued request re-checks its position / the client connection
+QUEUE_POLL_INTERVAL = float(os.environ.get("QUEUE_POLL_INTERVAL", 1.0))
+
+
+class QueueFullError(RuntimeError):
+    """Raised by reserve() when every slot is busy and the wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"generation queue is full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A place in line for one generation; release() it when done (or abandoned)."""
+
+    def __init__(self, scheduler: "GenerationScheduler"):
+        self._scheduler = scheduler
+        self._granted = asyncio.Event()
+        self._released = False
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.is_set()
+
+    def position(self) -> int:
+        """1-based position in the wait queue, or 0 once the ticket holds a slot."""
+        return self._scheduler._position(self)
+
+    async def wait(self) -> AsyncIterator[int]:
+        """Wait for a slot, yielding the current queue position on every poll tick."""
+        while not self.granted:
+            yield self.position()
+            try:
+                await asyncio.wait_for(self._granted.wait(), timeout=QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self):
+        async for _ in self.wait():
+            pass
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self)
+
+
+class GenerationScheduler:
+    """Hand out at most ``max_concurrent`` generation slots; queue up to ``max_queue`` more.
+
+    ``reserve()`` is synchronous so an endpoint can reject with 429 before it
+    starts streaming. Batch work waits in its own queue: it never counts
+    against ``max_queue`` and a freed slot always goes to an interactive
+    waiter first. Each queue is served first-in first-out.
+    """
+
+    def __init__(self, max_concurrent: int = None, max_queue: int = None, retry_after: int = None):
+        self.max_concurrent = max_concurrent or MAX_CONCURRENT_GENERATIONS
+        self.max_queue = MAX_QUEUED_GENERATIONS if max_queue is None else max_queue
+        self.retry_after = retry_after or GENERATION_RETRY_AFTER
+        self.active = 0
+        self._waiting = deque()
+        self._batch_waiting = deque()
+
+    def reserve(self, batch: bool = False) -> Ticket:
+        """Take a slot now or a place in the queue.
+
+        Interactive requests raise QueueFullError once ``max_queue`` of them are
+        waiting. ``batch=True`` tickets are never rejected; they wait behind
+        every interactive request instead.
+        """
+        ticket = Ticket(self)
+        if self.active < self.max_concurrent and not self._waiting and not (batch and self._batch_waiting):
+            self.active += 1
+            ticket._granted.set()
+        elif batch:
+            self._batch_waiting.append(ticket)
+        elif len(self._waiting) < self.max_queue:
+            self._waiting.append(ticket)
+        else:
+            raise QueueFullError(self.retry_after)
+        return ticket
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": len(self._waiting), "batch_queued": len(self._batch_waiting),
+                "max_concurrent": self.max_concurrent, "max_queue": self.max_queue}
+
+    def _position(self, ticket: Ticket) -> int:
+        if ticket.granted:
+            return 0
+        if ticket in self._waiting:
+            return self._waiting.index(ticket) + 1
+        if ticket in self._batch_waiting:
+            return len(self._waiting) + self._batch_waiting.index(ticket) + 1
+        return 0
+
+    def _release(self, ticket: Ticket):
+        if ticket.granted:
+            self.active -= 1
+        else:
+            # abandoned while still queued
+            for queue in (self._waiting, self._batch_waiting):
+                if ticket in queue:
+                    queue.remove(ticket)
+                    break
+        while self.active < self.max_concurrent and (self._waiting or self._batch_waiting):
+            nxt = (self._waiting or self._batch_waiting).popleft()
+            self.active += 1
+            nxt._granted.set()
+
+
+_scheduler: Optional[GenerationScheduler] = None
+
+
+def get_scheduler() -> GenerationScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = GenerationScheduler()
+    return _scheduler
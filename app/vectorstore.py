@@ -1,6 +1,7 @@
 """Simple Chroma wrapper for upsert and similarity search."""
 from typing import List, Dict, Optional
 import math
+import os
 try:
     import chromadb
     from chromadb.config import Settings
@@ -19,11 +20,94 @@ def _cosine(a, b):
     return dot / (maga * magb)
 
 
+# HNSW index settings understood by Chroma, keyed by the names we expose
+HNSW_METADATA_KEYS = {
+    "space": "hnsw:space",
+    "M": "hnsw:M",
+    "construction_ef": "hnsw:construction_ef",
+    "search_ef": "hnsw:search_ef",
+}
+
+
+def index_params_from_env(collection_name: str) -> Dict:
+    """Read HNSW settings for a collection from the environment.
+
+    ``CHROMA_<COLLECTION>_HNSW_<PARAM>`` wins over the global
+    ``CHROMA_HNSW_<PARAM>``; anything unset is left to Chroma's defaults.
+    """
+    params = {}
+    for name in HNSW_METADATA_KEYS:
+        suffix = f"HNSW_{name.upper()}"
+        value = os.environ.get(f"CHROMA_{collection_name.upper()}_{suffix}") or os.environ.get(f"CHROMA_{suffix}")
+        if value:
+            params[name] = value if name == "space" else int(value)
+    return params
+
+
+def hnsw_metadata(params: Optional[Dict]) -> Dict:
+    """Translate {"space", "M", "construction_ef", "search_ef"} into Chroma collection metadata."""
+    md = {}
+    for name, value in (params or {}).items():
+        if name not in HNSW_METADATA_KEYS:
+            raise ValueError(f"unknown HNSW parameter: {name}")
+        if value is not None:
+            md[HNSW_METADATA_KEYS[name]] = value
+    return md
+
+
+def _split_tags(tags) -> List[str]:
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return [t.strip() for t in tags if t and t.strip()]
+
+
+def tag_metadata(tags) -> Dict:
+    """Chunk metadata for tags: a readable "tags" string plus one boolean flag per tag.
+
+    Chroma metadata values must be scalars, so the ``tag:<name>`` flags are what
+    the where clause filters on.
+    """
+    tags = _split_tags(tags)
+    if not tags:
+        return {}
+    md = {"tags": ",".join(tags)}
+    for t in tags:
+        md[f"tag:{t}"] = True
+    return md
+
+
+def build_where(sources: Optional[List[str]] = None, tags: Optional[List[str]] = None) -> Optional[Dict]:
+    """Chroma where clause: chunk must come from one of ``sources`` and carry any of ``tags``."""
+    clauses = []
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    tag_clauses = [{f"tag:{t}": True} for t in _split_tags(tags)]
+    if len(tag_clauses) == 1:
+        clauses.append(tag_clauses[0])
+    elif tag_clauses:
+        clauses.append({"$or": tag_clauses})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _hits(ids, documents, distances, metadatas) -> List[Dict]:
+    metadatas = list(metadatas or [])
+    metadatas += [None] * (len(ids) - len(metadatas))
+    return [{"id": idx, "text": doc, "score": dist, "metadata": md or {}}
+            for idx, doc, dist, md in zip(ids, documents, distances, metadatas)]
+
+
 class ChromaClientWrapper:
-    def __init__(self, persist_directory: str = "./chroma_db"):
+    def __init__(self, persist_directory: str = "./chroma_db", index_params: Optional[Dict[str, Dict]] = None):
         self.persist_directory = persist_directory
+        # per-collection HNSW overrides, e.g. {"usecases": {"space": "cosine", "M": 32}}
+        self.index_params = index_params or {}
         self._memory_docs = []  # fallback store
         self._sources = {}  # map source -> count
+        self._by_source = {}  # map source -> memory docs, so scoped searches skip other documents
         self.collection = None
         self.meta_collection = None
         print(f"Initializing ChromaClientWrapper with {persist_directory}")
@@ -31,8 +115,8 @@ class ChromaClientWrapper:
             try:
                 # Modern Chroma (0.4+) uses PersistentClient
                 self.client = chromadb.PersistentClient(path=persist_directory)
-                self.collection = self.client.get_or_create_collection("usecases")
-                self.meta_collection = self.client.get_or_create_collection("file_metadata")
+                self.collection = self._open_collection("usecases")
+                self.meta_collection = self._open_collection("file_metadata")
                 print("ChromaDB PersistentClient initialized. Collections 'usecases' and 'file_metadata' ready.")
             except Exception as e:
                 print(f"Error initializing ChromaDB: {e}. Falling back to memory.")
@@ -41,6 +125,114 @@ class ChromaClientWrapper:
             print("ChromaDB NOT AVAILABLE. Using memory store.")
             self.collection = None
 
+    def _params_for(self, name: str) -> Dict:
+        params = index_params_from_env(name)
+        params.update(self.index_params.get(name, {}))
+        return params
+
+    def _collection_names(self) -> List[str]:
+        # Chroma 0.4/0.5 return Collection objects, 0.6+ returns names
+        return [getattr(c, "name", c) for c in self.client.list_collections()]
+
+    def _open_collection(self, name: str):
+        md = hnsw_metadata(self._params_for(name))
+        names = self._collection_names()
+        backup = f"{name}_backup"
+        if name not in names and backup in names:
+            # an interrupted rebuild left the data under the backup name; put it back
+            print(f"Restoring collection '{name}' from '{backup}' left by an interrupted rebuild.")
+            self.client.get_collection(backup).modify(name=name)
+            names.append(name)
+        if name in names:
+            # never pass metadata for an existing collection: older Chroma overwrites the
+            # stored hnsw:* values without rebuilding the index, hiding the real settings
+            collection = self.client.get_collection(name)
+        else:
+            collection = self.client.create_collection(name, metadata=md or None)
+        # HNSW settings are fixed at creation time; tell the operator if config drifted
+        current = collection.metadata or {}
+        drift = {k: v for k, v in md.items() if current.get(k) != v}
+        if drift:
+            print(f"Collection '{name}' was built with different index settings than configured {drift}. "
+                  f"Run scripts/chroma_index.py rebuild to apply them.")
+        return collection
+
+    def get_index_params(self, name: str = "usecases") -> Dict:
+        """Return the HNSW settings a collection was created with (only those set explicitly)."""
+        if not CHROMADB_AVAILABLE or self.collection is None:
+            return {}
+        md = self.client.get_collection(name).metadata or {}
+        return {k: md[v] for k, v in HNSW_METADATA_KEYS.items() if v in md}
+
+    def rebuild_collection(self, name: str = "usecases", index_params: Optional[Dict] = None, batch_size: int = 500) -> int:
+        """Recreate a collection with new HNSW settings, copying ids, documents, metadata and embeddings.
+
+        Settings are the collection's current ones, overlaid with the configured
+        (env / constructor) values and then with ``index_params``.
+
+        The copy is built under ``<name>_rebuild``; the original is then renamed
+        to ``<name>_backup`` and only deleted after the copy has taken its name.
+        If the swap fails the backup is renamed back, and if the process dies
+        mid-swap the next start restores it (see ``_open_collection``).
+        Other processes holding the collection (e.g. a running API server)
+        must be restarted to see the rebuilt index.
+        Returns the number of records migrated.
+        """
+        if not CHROMADB_AVAILABLE or self.collection is None:
+            raise RuntimeError("ChromaDB is not available; nothing to rebuild")
+        # start from what the collection was built with so a single override keeps the rest
+        params = self.get_index_params(name)
+        params.update(self._params_for(name))
+        params.update(index_params or {})
+        md = hnsw_metadata(params)
+
+        source = self.client.get_collection(name)
+        res = source.get(include=["documents", "metadatas", "embeddings"])
+        ids = res.get("ids") or []
+        tmp_name = f"{name}_rebuild"
+        try:
+            self.client.delete_collection(tmp_name)
+        except Exception:
+            pass
+        target = self.client.create_collection(tmp_name, metadata=md or None)
+        print(f"Rebuilding '{name}' ({len(ids)} records) with {md or 'default settings'}...")
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            target.add(
+                ids=ids[start:end],
+                documents=res["documents"][start:end],
+                metadatas=res["metadatas"][start:end],
+                embeddings=[list(e) for e in res["embeddings"][start:end]],
+            )
+
+        backup_name = f"{name}_backup"
+        if backup_name in self._collection_names():
+            # stale backup from an earlier rebuild that finished swapping
+            self.client.delete_collection(backup_name)
+        try:
+            source.modify(name=backup_name)
+        except Exception:
+            self.client.delete_collection(tmp_name)
+            raise
+        try:
+            target.modify(name=name)
+        except Exception:
+            print(f"Swapping rebuilt collection into '{name}' failed; restoring the original.")
+            self.client.get_collection(backup_name).modify(name=name)
+            try:
+                self.client.delete_collection(tmp_name)
+            except Exception:
+                pass
+            raise
+        self.client.delete_collection(backup_name)
+        rebuilt = self.client.get_collection(name)
+        if name == "usecases":
+            self.collection = rebuilt
+        elif name == "file_metadata":
+            self.meta_collection = rebuilt
+        print(f"Collection '{name}' rebuilt.")
+        return len(ids)
+
     def reset_collections(self):
         """Delete all documents from both collections."""
         if self.collection:
@@ -63,16 +255,23 @@ class ChromaClientWrapper:
                 print(f"Failed to clear metadata collection: {e}")
         
         self._sources = {}
+        self._by_source = {}
         self._memory_docs = []
 
-    def save_file_metadata(self, filename: str, size: int, timestamp: str):
+    def save_file_metadata(self, filename: str, size: int, timestamp: str, sha256: Optional[str] = None,
+                           tags: Optional[List[str]] = None):
         """Store file-level metadata in the meta_collection."""
         if self.meta_collection:
             try:
+                md = {"filename": filename, "size": size, "timestamp": timestamp}
+                if sha256:
+                    md["sha256"] = sha256
+                if _split_tags(tags):
+                    md["tags"] = ",".join(_split_tags(tags))
                 self.meta_collection.upsert(
                     ids=[filename],
                     documents=[f"File: {filename}, Size: {size}, Uploaded: {timestamp}"],
-                    metadatas=[{"filename": filename, "size": size, "timestamp": timestamp}]
+                    metadatas=[md]
                 )
                 print(f"Metadata saved for {filename}")
             except Exception as e:
@@ -105,43 +304,89 @@ class ChromaClientWrapper:
             emb = None
             if embeddings is not None and i < len(embeddings):
                 emb = embeddings[i]
-            self._memory_docs.append({"id": d["id"], "text": d["text"], "metadata": metadatas[i], "embedding": emb})
+            entry = {"id": d["id"], "text": d["text"], "metadata": metadatas[i], "embedding": emb}
+            self._memory_docs.append(entry)
             # track source counts for listing
             src = metadatas[i].get("source") if isinstance(metadatas[i], dict) else None
             if src:
                 self._sources[src] = self._sources.get(src, 0) + 1
+                self._by_source.setdefault(src, []).append(entry)
 
-    def similarity_search_by_embedding(self, embedding, top_k: int = 4):
+    def similarity_search_by_embeddings(self, embeddings, top_k: int = 4, sources: Optional[List[str]] = None,
+                                        tags: Optional[List[str]] = None) -> List[List[Dict]]:
+        """Search several query vectors at once; returns one hit list per query."""
+        if not embeddings:
+            return []
         if self.collection is not None:
             try:
+                # One round trip for the whole batch via multi-vector query_embeddings
+                kwargs = {"query_embeddings": list(embeddings), "n_results": top_k}
+                where = build_where(sources, tags)
+                if where:
+                    kwargs["where"] = where
+                results = self.collection.query(**kwargs)
+                all_ids = results.get("ids") or []
+                all_documents = results.get("documents") or []
+                all_distances = results.get("distances") or []
+                all_metadatas = results.get("metadatas") or [[] for _ in all_ids]
+                out = []
+                for ids, documents, distances, metadatas in zip(all_ids, all_documents, all_distances, all_metadatas):
+                    out.append(_hits(ids, documents, distances, metadatas))
+                return out
+            except Exception as e:
+                print(f"Chroma batch query failed: {e}")
+                import traceback
+                traceback.print_exc()
+
+        # memory fallback: reuse the single-vector path per query
+        return [self._memory_search(emb, top_k, sources, tags) for emb in embeddings]
+
+    def similarity_search_by_embedding(self, embedding, top_k: int = 4, sources: Optional[List[str]] = None,
+                                       tags: Optional[List[str]] = None):
+        if self.collection is not None:
+            try:
+                # Filters are pushed down to Chroma so only matching chunks are scored
+                kwargs = {"query_embeddings": [embedding], "n_results": top_k}
+                where = build_where(sources, tags)
+                if where:
+                    kwargs["where"] = where
                 # Results for 0.4+/0.5+ are dicts with list of lists
-                results = self.collection.query(query_embeddings=[embedding], n_results=top_k)
-                docs = []
+                results = self.collection.query(**kwargs)
                 # Check for nested results
                 ids = results.get("ids", [[]])[0]
                 documents = results.get("documents", [[]])[0]
                 distances = results.get("distances", [[]])[0]
-                
-                for idx, doc, dist in zip(ids, documents, distances):
-                    docs.append({"id": idx, "text": doc, "score": dist})
-                return docs
+                metadatas = (results.get("metadatas") or [[]])[0]
+                return _hits(ids, documents, distances, metadatas)
             except Exception as e:
                 print(f"Chroma query failed: {e}")
                 import traceback
                 traceback.print_exc()
 
-        # memory fallback: compute cosine similarity against stored embeddings
+        return self._memory_search(embedding, top_k, sources, tags)
+
+    def _memory_search(self, embedding, top_k: int = 4, sources: Optional[List[str]] = None,
+                       tags: Optional[List[str]] = None):
+        # memory fallback: compute cosine similarity against stored embeddings,
+        # scanning only the requested sources via the per-source index
+        if sources:
+            candidates = [d for src in dict.fromkeys(sources) for d in self._by_source.get(src, [])]
+        else:
+            candidates = self._memory_docs
+        wanted_tags = set(_split_tags(tags))
         scored = []
-        for d in self._memory_docs:
+        for d in candidates:
             emb = d.get("embedding")
             if emb is None:
                 continue
+            if wanted_tags and not wanted_tags & set(_split_tags(d["metadata"].get("tags"))):
+                continue
             score = _cosine(embedding, emb)
             scored.append((score, d))
         scored.sort(key=lambda x: x[0], reverse=True)
         out = []
         for score, d in scored[:top_k]:
-            out.append({"id": d["id"], "text": d["text"], "score": float(score)})
+            out.append({"id": d["id"], "text": d["text"], "score": float(score), "metadata": d["metadata"]})
         return out
 
     def list_documents(self):
@@ -20,6 +20,10 @@ export default function App() {
         body: JSON.stringify({ query: q, top_k: 4 })
       });
 
+      if (response.status === 429) {
+        const wait = response.headers.get('Retry-After');
+        throw new Error(`The assistant is busy. Please try again${wait ? ` in ${wait} seconds` : ''}.`);
+      }
       if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
 
       const reader = response.body.getReader();
@@ -40,8 +44,10 @@ export default function App() {
             const part = JSON.parse(line);
             if (part.type === 'sources') {
               setResp(prev => ({ ...prev, sources: part.data }));
+            } else if (part.type === 'queued') {
+              setResp(prev => ({ ...prev, queuePosition: part.position }));
             } else if (part.type === 'chunk') {
-              setResp(prev => ({ ...prev, answer: prev.answer + part.data }));
+              setResp(prev => ({ ...prev, queuePosition: 0, answer: prev.answer + part.data }));
             }
           } catch (e) {
             console.error('Error parsing stream line:', line, e);
@@ -178,7 +184,7 @@ export default function App() {
           <section className="results" style={{ marginTop: 24 }}>
             <h2 style={{ fontSize: 18, borderBottom: '1px solid #eee', paddingBottom: 8 }}>AI Assistant Response</h2>
             <div className="answer-box" style={{ whiteSpace: 'pre-wrap', lineHeight: 1.6 }}>
-              {resp.answer || <span style={{ color: '#999' }}>Generating answer...</span>}
+              {resp.answer || <span style={{ color: '#999' }}>{resp.queuePosition > 0 ? `Waiting in queue (position ${resp.queuePosition})...` : 'Generating answer...'}</span>}
             </div>
 
             {resp.sources?.length > 0 && (
@@ -187,7 +193,7 @@ export default function App() {
                 <div className="sources-grid" style={{ display: 'grid', gridTemplateColumns: '1fr 1fr', gap: 10 }}>
                   {resp.sources.map((s, idx) => (
                     <div key={idx} style={{ padding: 10, backgroundColor: '#f8fbff', border: '1px solid #e1e8f5', borderRadius: 6, fontSize: 12 }}>
-                      <div style={{ fontWeight: 'bold', color: 'var(--citi-blue)', marginBottom: 4 }}>Source {idx + 1}</div>
+                      <div style={{ fontWeight: 'bold', color: 'var(--citi-blue)', marginBottom: 4 }}>Source {idx + 1}{s.metadata?.source ? ` · ${s.metadata.source}` : ''}</div>
                       <div style={{ color: '#555', height: 60, overflow: 'hidden', textOverflow: 'ellipsis', display: '-webkit-box', WebkitLineClamp: 4, WebkitBoxOrient: 'vertical' }}>
                         {s.text}
                       </div>
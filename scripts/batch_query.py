@@ -0,0 +1,69 @@
+"""Answer a file of questions against the Chroma store and write NDJSON results."""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import sys
+from dotenv import load_dotenv
+load_dotenv()
+from app.batch import run_batch, MAX_BATCH_QUERIES
+from app.vectorstore import ChromaClientWrapper
+
+
+def load_questions(path: Path):
+    # Plain text (one question per line) or JSONL with a "query" field
+    questions = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            questions.append(json.loads(line)["query"])
+        else:
+            questions.append(line)
+    return questions
+
+
+async def run(questions, persist, top_k, concurrency, out, sources=None, tags=None):
+    db = ChromaClientWrapper(persist_directory=persist)
+    # work through the file in windows so embeddings and hits for every question are never held at once
+    for offset in range(0, len(questions), MAX_BATCH_QUERIES):
+        window = questions[offset:offset + MAX_BATCH_QUERIES]
+        async for result in run_batch(window, db, top_k=top_k, concurrency=concurrency, sources=sources, tags=tags):
+            result["index"] += offset
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", "-q", required=True, help="text file (one per line) or JSONL with 'query'")
+    parser.add_argument("--persist", "-d", default="./chroma_db")
+    parser.add_argument("--top-k", "-k", type=int, default=4)
+    parser.add_argument("--concurrency", "-c", type=int, default=None)
+    parser.add_argument("--output", "-o", default=None, help="NDJSON output file (default: stdout)")
+    parser.add_argument("--source", "-s", action="append", help="restrict retrieval to this document (repeatable)")
+    parser.add_argument("--tag", "-t", action="append", help="restrict retrieval to chunks with this tag (repeatable)")
+    args = parser.parse_args()
+
+    qfile = Path(args.questions)
+    if not qfile.exists():
+        print("Questions file not found", qfile)
+        return 2
+
+    questions = load_questions(qfile)
+    if not questions:
+        print("No questions found in", qfile)
+        return 2
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        asyncio.run(run(questions, args.persist, args.top_k, args.concurrency, out, args.source, args.tag))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,72 @@
+"""Inspect, rebuild and tune the HNSW index settings of the Chroma collections."""
+import argparse
+import json
+from dotenv import load_dotenv
+load_dotenv()
+from app.vectorstore import ChromaClientWrapper
+
+
+def index_params_from_args(args):
+    params = {}
+    for name in ("space", "M", "construction_ef", "search_ef"):
+        value = getattr(args, name)
+        if value is not None:
+            params[name] = value
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--persist", "-d", default="./chroma_db")
+    parser.add_argument("--collection", "-c", default="usecases")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("show", help="print the collection's current HNSW settings")
+
+    rebuild = sub.add_parser("rebuild", help="recreate the collection with new HNSW settings")
+    rebuild.add_argument("--space", choices=["l2", "ip", "cosine"])
+    rebuild.add_argument("--M", type=int)
+    rebuild.add_argument("--construction-ef", dest="construction_ef", type=int)
+    rebuild.add_argument("--search-ef", dest="search_ef", type=int)
+
+    tune = sub.add_parser("tune", help="report recall@k vs latency over a grid of settings")
+    tune.add_argument("--grid", default="M=8,16,32 construction_ef=100,200 search_ef=10,50,100",
+                      help='e.g. "space=l2,cosine M=8,16 construction_ef=100 search_ef=10,50"')
+    tune.add_argument("--k", type=int, default=4)
+    tune.add_argument("--queries", "-n", type=int, default=100, help="number of stored vectors to use as queries")
+    tune.add_argument("--json", action="store_true", help="emit rows as JSON lines")
+    args = parser.parse_args()
+
+    db = ChromaClientWrapper(persist_directory=args.persist)
+    if db.collection is None:
+        print("ChromaDB not available at", args.persist)
+        return 2
+
+    if args.command == "show":
+        print(json.dumps(db.get_index_params(args.collection) or "chroma defaults"))
+        return 0
+
+    if args.command == "rebuild":
+        count = db.rebuild_collection(args.collection, index_params_from_args(args))
+        print(f"Rebuilt {args.collection} with {count} records: {db.get_index_params(args.collection)}")
+        return 0
+
+    from app.index_tuning import parse_grid, run_grid, format_report
+    res = db.client.get_collection(args.collection).get(include=["embeddings"])
+    ids = res.get("ids") or []
+    if not ids:
+        print("Collection is empty; ingest documents first.")
+        return 2
+    current = db.get_index_params(args.collection)
+    rows = run_grid(ids, res["embeddings"], parse_grid(args.grid), k=args.k,
+                    n_queries=args.queries, space=current.get("space", "l2"))
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        print(format_report(rows))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
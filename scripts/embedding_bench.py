@@ -0,0 +1,72 @@
+"""Check ONNX embedding parity against PyTorch and benchmark throughput per backend."""
+from pathlib import Path
+import argparse
+import time
+from dotenv import load_dotenv
+load_dotenv()
+import numpy as np
+from app.ingest import chunk_text
+from app.llm import load_embedding_model
+
+
+def sample_texts(path: Path, n: int):
+    chunks = chunk_text(path.read_text(encoding="utf-8"))
+    if not chunks:
+        raise SystemExit(f"No text in {path}")
+    # Mix full chunks with shorter slices so batches see realistic length variance
+    texts = []
+    i = 0
+    while len(texts) < n:
+        c = chunks[i % len(chunks)]
+        texts.append(c if i % 3 else c[: 80 + (i * 37) % 400])
+        i += 1
+    return texts
+
+
+def cosine_agreement(ref, other):
+    ref = ref / np.linalg.norm(ref, axis=1, keepdims=True)
+    other = other / np.linalg.norm(other, axis=1, keepdims=True)
+    return (ref * other).sum(axis=1)
+
+
+def throughput(model, texts, batch_size: int):
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    start = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--text", "-t", default="usecase2.md", help="document to sample chunks from")
+    parser.add_argument("--backends", "-b", default="torch,onnx,onnx-int8")
+    parser.add_argument("--batch-sizes", default="1,32,256")
+    parser.add_argument("--n", type=int, default=256, help="texts per throughput run")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="parity threshold vs torch")
+    args = parser.parse_args()
+
+    texts = sample_texts(Path(args.text), args.n)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+
+    reference = load_embedding_model("torch")
+    ref_vecs = reference.encode(texts, batch_size=32)
+    failed = False
+
+    print(f"{'backend':<10} {'cos_mean':>9} {'cos_min':>9} " + " ".join(f"{'bs=' + str(b) + ' txt/s':>14}" for b in batch_sizes))
+    for backend in backends:
+        model = reference if backend == "torch" else load_embedding_model(backend)
+        cos = cosine_agreement(ref_vecs, model.encode(texts, batch_size=32))
+        if cos.min() < args.min_cosine:
+            failed = True
+        rates = [throughput(model, texts, b) for b in batch_sizes]
+        print(f"{backend:<10} {cos.mean():>9.5f} {cos.min():>9.5f} " + " ".join(f"{r:>14.1f}" for r in rates))
+
+    if failed:
+        print(f"Parity check FAILED: some backend fell below cosine {args.min_cosine} vs torch.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
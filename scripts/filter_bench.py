@@ -0,0 +1,61 @@
+"""Compare source-filtered vs global similarity search latency as the corpus grows."""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from app.vectorstore import ChromaClientWrapper
+
+
+def synthetic_docs(n: int, n_sources: int, dim: int, rng: random.Random):
+    docs, embeddings = [], []
+    for i in range(n):
+        src = f"doc-{i % n_sources}.pdf"
+        docs.append({"id": f"{src}-{i}", "text": f"chunk {i}", "metadata": {"source": src, "chunk": i}})
+        embeddings.append([rng.uniform(-1, 1) for _ in range(dim)])
+    return docs, embeddings
+
+
+def time_queries(db, queries, top_k, sources=None):
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        db.similarity_search_by_embedding(q, top_k=top_k, sources=sources)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,5000,20000", help="corpus sizes (chunks)")
+    parser.add_argument("--sources", type=int, default=20, help="number of documents the chunks are spread over")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--memory", action="store_true", help="benchmark the in-memory fallback instead of Chroma")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    queries = [[rng.uniform(-1, 1) for _ in range(args.dim)] for _ in range(args.queries)]
+    backend = "memory" if args.memory else "chroma"
+
+    print(f"{'backend':<8} {'chunks':>8} {'global ms':>10} {'p95':>8} {'filtered ms':>12} {'p95':>8} {'speedup':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        docs, embeddings = synthetic_docs(size, args.sources, args.dim, rng)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = ChromaClientWrapper(persist_directory=tmp)
+            if args.memory:
+                db.collection = None
+            for start in range(0, size, 1000):
+                db.upsert_documents(docs[start:start + 1000], embeddings=embeddings[start:start + 1000])
+
+            g_mean, g_p95 = time_queries(db, queries, args.top_k)
+            f_mean, f_p95 = time_queries(db, queries, args.top_k, sources=["doc-0.pdf"])
+            print(f"{backend:<8} {size:>8} {g_mean:>10.2f} {g_p95:>8.2f} {f_mean:>12.2f} {f_p95:>8.2f} "
+                  f"{g_mean / f_mean:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -27,6 +27,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--pdf", "-p", required=True)
     parser.add_argument("--persist", "-d", default="./chroma_db")
+    parser.add_argument("--tags", "-t", default="", help="comma-separated tags for scoped search")
     args = parser.parse_args()
 
     pdf = Path(args.pdf)
@@ -45,7 +46,8 @@ def main():
     chunks = chunk_text(full_text)
 
     # Try to get embeddings via Ollama; optional fallback controlled by ENABLE_EMBEDDING_FALLBACK
-    count = ingest_pdf_file(pdf, persist_directory=args.persist)
+    tags = [t.strip() for t in args.tags.split(",") if t.strip()]
+    count = ingest_pdf_file(pdf, persist_directory=args.persist, tags=tags)
     print(f"Upserted {count} chunks into {args.persist}")
 
 
@@ -33,6 +33,416 @@ class BackendTests(unittest.TestCase):
         self.assertIn('sources', data)
         self.assertTrue('TEST_ANSWER' in data['answer'] or data['answer'] == 'TEST_ANSWER')
 
+    @patch('app.main.MAX_UPLOAD_BYTES', 1024)
+    @patch('app.main.ingest_pdf_file')
+    def test_upload_rejected_from_content_length(self, mock_ingest):
+        payload = b'%PDF-1.4 ' + b'x' * (200 * 1024)
+        r = self.client.post('/api/ingest/upload', files={'file': ('big.pdf', payload, 'application/pdf')})
+        self.assertEqual(r.status_code, 413)
+        mock_ingest.assert_not_called()
+
+    @patch('app.batch.get_embeddings', return_value=[[0.0], [1.0], [2.0]])
+    @patch('app.main.db.similarity_search_by_embeddings', return_value=[[], [], []])
+    @patch('app.batch.call_ollama_generate', side_effect=lambda prompt, model, stream: 'ANSWER')
+    def test_query_batch(self, mock_gen, mock_search, mock_emb):
+        import json
+        payload = {'queries': ['q1', 'q2', 'q3'], 'top_k': 2, 'concurrency': 2}
+        r = self.client.post('/api/query/batch', json=payload)
+        self.assertEqual(r.status_code, 200)
+        lines = [json.loads(l) for l in r.text.splitlines() if l]
+        results = [l for l in lines if l['type'] == 'result']
+        self.assertEqual(sorted(l['index'] for l in results), [0, 1, 2])
+        self.assertTrue(all(l['answer'] == 'ANSWER' for l in results))
+        self.assertEqual(lines[-1]['type'], 'done')
+        # one embedding pass and one vector query for the whole batch
+        mock_emb.assert_called_once_with(['q1', 'q2', 'q3'])
+        mock_search.assert_called_once()
+        self.assertEqual(mock_gen.call_count, 3)
+
+    @patch.dict(os.environ, {'CHROMA_HNSW_M': '16', 'CHROMA_USECASES_HNSW_M': '32', 'CHROMA_HNSW_SPACE': 'cosine'})
+    def test_index_params(self):
+        from app.vectorstore import index_params_from_env, hnsw_metadata
+        self.assertEqual(index_params_from_env('usecases'), {'space': 'cosine', 'M': 32})
+        self.assertEqual(index_params_from_env('file_metadata'), {'space': 'cosine', 'M': 16})
+        self.assertEqual(hnsw_metadata({'M': 32, 'search_ef': 50}), {'hnsw:M': 32, 'hnsw:search_ef': 50})
+        with self.assertRaises(ValueError):
+            hnsw_metadata({'ef': 10})
+
+    def test_exact_ground_truth_recall(self):
+        from app.index_tuning import exact_top_k, recall_at_k
+        corpus = [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [-1.0, 0.0]]
+        top = exact_top_k([[1.0, 0.05]], corpus, k=2, space='cosine')
+        self.assertEqual(top.tolist(), [[0, 1]])
+        self.assertEqual(recall_at_k([['a', 'b']], [['a', 'c']]), 0.5)
+
+    def test_rebuild_keeps_existing_index_settings(self):
+        from unittest.mock import MagicMock
+        import app.vectorstore as vs
+
+        class FakeCollection:
+            def __init__(self, client, name, metadata=None):
+                self.client, self.name, self.metadata, self.records = client, name, metadata, []
+
+            def get(self, include=None):
+                return {'ids': [r[0] for r in self.records], 'documents': [r[1] for r in self.records],
+                        'metadatas': [r[2] for r in self.records], 'embeddings': [r[3] for r in self.records]}
+
+            def add(self, ids, documents, metadatas, embeddings):
+                self.records += list(zip(ids, documents, metadatas, embeddings))
+
+            def modify(self, name):
+                self.client.collections[name] = self.client.collections.pop(self.name)
+                self.name = name
+
+        class FakeClient:
+            def __init__(self):
+                self.collections = {}
+
+            def list_collections(self):
+                return list(self.collections)
+
+            def get_collection(self, name):
+                return self.collections[name]
+
+            def create_collection(self, name, metadata=None):
+                self.collections[name] = FakeCollection(self, name, metadata)
+                return self.collections[name]
+
+            def delete_collection(self, name):
+                del self.collections[name]
+
+        client = FakeClient()
+        client.create_collection('usecases', {'hnsw:space': 'cosine', 'hnsw:M': 32})
+        client.get_collection('usecases').add(['a'], ['text'], [{'source': 'a.pdf'}], [[1.0, 0.0]])
+        chromadb = MagicMock()
+        chromadb.PersistentClient.return_value = client
+        env = {k: v for k, v in os.environ.items() if 'HNSW' not in k}
+        with patch.object(vs, 'CHROMADB_AVAILABLE', True), patch.object(vs, 'chromadb', chromadb, create=True), \
+                patch.dict(os.environ, env, clear=True):
+            # opening an existing collection must not rewrite its stored settings
+            vs.ChromaClientWrapper(persist_directory='unused', index_params={'usecases': {'M': 8}})
+            self.assertEqual(client.get_collection('usecases').metadata, {'hnsw:space': 'cosine', 'hnsw:M': 32})
+
+            db = vs.ChromaClientWrapper(persist_directory='unused')
+            self.assertEqual(db.rebuild_collection('usecases', {'search_ef': 64}), 1)
+        rebuilt = client.get_collection('usecases')
+        self.assertEqual(rebuilt.metadata, {'hnsw:space': 'cosine', 'hnsw:M': 32, 'hnsw:search_ef': 64})
+        self.assertEqual(rebuilt.get()['ids'], ['a'])
+        self.assertEqual(sorted(client.list_collections()), ['file_metadata', 'usecases'])
+
+    def test_circuit_breaker_skips_until_probe_succeeds(self):
+        import time
+        from app.ollama_client import CircuitBreaker, BackendUnavailableError
+        healthy = {'ok': False}
+
+        def probe():
+            if not healthy['ok']:
+                raise RuntimeError('down')
+
+        def boom():
+            raise ConnectionError('down')
+
+        breaker = CircuitBreaker('test', probe=probe, failure_threshold=2, probe_interval=0.01)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(boom)
+        self.assertFalse(breaker.allow())
+        with self.assertRaises(BackendUnavailableError):
+            breaker.call(lambda: 'never called')
+
+        healthy['ok'] = True
+        deadline = time.time() + 2
+        while not breaker.allow() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+
+    def test_ollama_4xx_does_not_trip_breakers(self):
+        import requests
+        from app import llm
+        resp = requests.Response()
+        resp.status_code = 404
+        not_found = requests.HTTPError('404 model does not support embeddings', response=resp)
+        with patch.object(llm.get_ollama_client(), 'embeddings', side_effect=not_found):
+            for _ in range(5):
+                with self.assertRaises(requests.HTTPError):
+                    llm.call_ollama_embeddings(['text'])
+        self.assertFalse(llm.ollama_embed_breaker.is_open)
+        self.assertFalse(llm.ollama_generate_breaker.is_open)
+
+    def test_ollama_generate_retry_policy(self):
+        import requests
+        from unittest.mock import MagicMock
+        from app.ollama_client import OllamaClient
+        client = OllamaClient(base_url='http://ollama.invalid', retries=2)
+
+        # read timeout on generate is not retried
+        client.session.post = MagicMock(side_effect=requests.ReadTimeout('slow'))
+        with self.assertRaises(requests.ReadTimeout):
+            client.generate({'prompt': 'x'})
+        self.assertEqual(client.session.post.call_count, 1)
+
+        # connect errors are retried
+        with patch('app.ollama_client.time.sleep'):
+            client.session.post = MagicMock(side_effect=requests.ConnectionError('refused'))
+            with self.assertRaises(requests.ConnectionError):
+                client.generate({'prompt': 'x'})
+        self.assertEqual(client.session.post.call_count, 3)
+
+        # a failed streamed response is closed so its connection returns to the pool
+        bad = MagicMock()
+        bad.raise_for_status.side_effect = requests.HTTPError('500', response=MagicMock(status_code=500))
+        client.session.post = MagicMock(return_value=bad)
+        with self.assertRaises(requests.HTTPError):
+            client.generate({'prompt': 'x'}, stream=True)
+        bad.close.assert_called()
+
+    @patch('app.llm.OLLAMA_EMBED_BATCH_SIZE', 2)
+    def test_ollama_embeddings_sub_batches(self):
+        from app import llm
+        with patch.object(llm.get_ollama_client(), 'embeddings',
+                          side_effect=lambda payload: {'embeddings': [[float(len(t))] for t in payload['input']]}) as mock_embed:
+            vecs = llm.call_ollama_embeddings(['a', 'bb', 'ccc', 'dddd', 'eeeee'])
+        self.assertEqual(vecs, [[1.0], [2.0], [3.0], [4.0], [5.0]])
+        self.assertEqual([len(c.args[0]['input']) for c in mock_embed.call_args_list], [2, 2, 1])
+
+    def test_query_batch_concurrency_is_bounded(self):
+        from app.batch import BATCH_CONCURRENCY
+        r = self.client.post('/api/query/batch', json={'queries': ['q1'], 'concurrency': BATCH_CONCURRENCY + 1})
+        self.assertEqual(r.status_code, 422)
+
+    def test_query_batch_size_is_bounded(self):
+        from app.batch import MAX_BATCH_QUERIES
+        r = self.client.post('/api/query/batch', json={'queries': ['q'] * (MAX_BATCH_QUERIES + 1)})
+        self.assertEqual(r.status_code, 422)
+
+    def test_generation_scheduler_queue(self):
+        import asyncio
+        from app.scheduler import GenerationScheduler, QueueFullError
+
+        async def scenario():
+            sched = GenerationScheduler(max_concurrent=1, max_queue=2, retry_after=7)
+            first = sched.reserve()
+            second = sched.reserve()
+            third = sched.reserve()
+            self.assertTrue(first.granted)
+            self.assertEqual((second.position(), third.position()), (1, 2))
+            with self.assertRaises(QueueFullError) as ctx:
+                sched.reserve()
+            self.assertEqual(ctx.exception.retry_after, 7)
+
+            # an abandoned waiter gives up its place; the next one moves up
+            second.release()
+            self.assertEqual(third.position(), 1)
+            first.release()
+            await asyncio.wait_for(third.acquire(), timeout=1)
+            self.assertTrue(third.granted)
+            third.release()
+            self.assertEqual(sched.stats()['active'], 0)
+
+        asyncio.run(scenario())
+
+    def test_batch_waiters_do_not_block_interactive(self):
+        import asyncio
+        from app.scheduler import GenerationScheduler
+
+        async def scenario():
+            sched = GenerationScheduler(max_concurrent=2, max_queue=1)
+            batch = [sched.reserve(batch=True) for _ in range(20)]
+            self.assertEqual(sum(t.granted for t in batch), 2)
+            # 18 batch waiters, yet an interactive request is still queued, not rejected
+            interactive = sched.reserve()
+            self.assertEqual(interactive.position(), 1)
+            # and it gets the next free slot ahead of every waiting batch ticket
+            batch[0].release()
+            self.assertTrue(interactive.granted)
+            self.assertFalse(batch[2].granted)
+            interactive.release()
+            self.assertTrue(batch[2].granted)
+            for t in batch:
+                t.release()
+            self.assertEqual(sched.stats()['active'], 0)
+
+        asyncio.run(scenario())
+
+    def test_cancelled_batch_holds_slot_until_worker_returns(self):
+        import asyncio
+        import threading
+        from app.scheduler import GenerationScheduler
+        from app.batch import run_batch
+
+        sched = GenerationScheduler(max_concurrent=1, max_queue=4)
+        unblock = threading.Event()
+
+        class SlowStream:
+            closed = False
+
+            def __iter__(self):
+                unblock.wait(5)
+                yield 'late answer'
+
+            def close(self):
+                self.closed = True
+
+        stream = SlowStream()
+
+        async def scenario():
+            db = app_main.db
+            with patch('app.batch.get_scheduler', return_value=sched), \
+                    patch('app.batch.get_embeddings', return_value=[[0.0]]), \
+                    patch.object(db, 'similarity_search_by_embeddings', return_value=[[]]), \
+                    patch('app.batch.call_ollama_generate', return_value=stream):
+                gen = run_batch(['q'], db)
+                pending = asyncio.ensure_future(gen.__anext__())
+                await asyncio.sleep(0.2)
+                self.assertEqual(sched.active, 1)
+                pending.cancel()
+                await asyncio.sleep(0.2)
+                # worker thread still inside Ollama: slot must not be handed out yet
+                self.assertTrue(stream.closed)
+                self.assertEqual(sched.active, 1)
+                unblock.set()
+                for _ in range(50):
+                    if sched.active == 0:
+                        break
+                    await asyncio.sleep(0.05)
+                self.assertEqual(sched.active, 0)
+
+        asyncio.run(scenario())
+
+    def test_query_rejected_when_queue_full(self):
+        from app.scheduler import GenerationScheduler
+        full = GenerationScheduler(max_concurrent=1, max_queue=0, retry_after=3)
+        held = full.reserve()
+        with patch('app.main.get_scheduler', return_value=full):
+            r = self.client.post('/api/query', json={'query': 'hello'})
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(r.headers.get('retry-after'), '3')
+        held.release()
+
+    def test_query_disconnect_before_first_token_closes_stream(self):
+        import asyncio
+        import json
+        import threading
+        from app.scheduler import GenerationScheduler
+
+        class BlockedStream:
+            """Never produces a token until close() is called."""
+
+            def __init__(self):
+                self.closed = threading.Event()
+
+            def __iter__(self):
+                self.closed.wait(timeout=5)
+                yield from ()
+
+            def close(self):
+                self.closed.set()
+
+        class DisconnectedRequest:
+            async def is_disconnected(self):
+                return False
+
+            async def receive(self):
+                return {'type': 'http.disconnect'}
+
+        stream = BlockedStream()
+        sched = GenerationScheduler(max_concurrent=1, max_queue=0)
+
+        async def consume():
+            response = await app_main.query(app_main.QueryRequest(query='hello'), DisconnectedRequest())
+            return [json.loads(line) async for line in response.body_iterator]
+
+        with patch('app.main.get_scheduler', return_value=sched), \
+                patch('app.main.get_embeddings', return_value=[[1.0]]), \
+                patch.object(app_main.db, 'similarity_search_by_embedding', return_value=[]), \
+                patch('app.main.call_ollama_generate', return_value=stream), \
+                patch.object(app_main.history_manager, 'save_message') as save:
+            lines = asyncio.run(asyncio.wait_for(consume(), timeout=2))
+        self.assertTrue(stream.closed.is_set())
+        self.assertEqual([l['type'] for l in lines], ['sources'])
+        self.assertEqual(sched.active, 0)
+        save.assert_not_called()
+
+    def test_scoped_memory_search(self):
+        from app.vectorstore import ChromaClientWrapper, build_where, tag_metadata
+        self.assertIsNone(build_where())
+        self.assertEqual(build_where(sources=['a.pdf']), {'source': {'$in': ['a.pdf']}})
+        self.assertEqual(build_where(sources=['a.pdf'], tags=['kyc', 'cards']),
+                         {'$and': [{'source': {'$in': ['a.pdf']}}, {'$or': [{'tag:kyc': True}, {'tag:cards': True}]}]})
+
+        db = ChromaClientWrapper(persist_directory='./test_chroma')
+        db.collection = None  # exercise the in-memory fallback
+        docs, embeddings = [], []
+        for i in range(6):
+            src = 'a.pdf' if i % 2 else 'b.pdf'
+            md = {'source': src, 'chunk': i, **tag_metadata(['kyc'] if i < 3 else [])}
+            docs.append({'id': f'{src}-{i}', 'text': f'chunk {i}', 'metadata': md})
+            embeddings.append([1.0, float(i)])
+        db.upsert_documents(docs, embeddings=embeddings)
+
+        hits = db.similarity_search_by_embedding([1.0, 0.0], top_k=10, sources=['a.pdf'])
+        self.assertEqual({h['metadata']['source'] for h in hits}, {'a.pdf'})
+        self.assertEqual(len(hits), 3)
+        hits = db.similarity_search_by_embedding([1.0, 0.0], top_k=10, sources=['a.pdf'], tags=['kyc'])
+        self.assertEqual([h['metadata']['chunk'] for h in hits], [1])
+        # tags are normalised the same way build_where does
+        for tags in (' kyc', 'kyc,cards', [' kyc ']):
+            hits = db.similarity_search_by_embedding([1.0, 0.0], top_k=10, sources=['a.pdf'], tags=tags)
+            self.assertEqual([h['metadata']['chunk'] for h in hits], [1])
+
+    def _fake_sentence_transformers(self, fail_onnx=False):
+        from unittest.mock import MagicMock
+        fake = MagicMock()
+
+        def make_model(name, backend='torch', **kwargs):
+            if fail_onnx and backend == 'onnx':
+                raise RuntimeError('optimum not installed')
+            return MagicMock(name=f'{backend}:{name}')
+
+        fake.SentenceTransformer.side_effect = make_model
+        return fake
+
+    def test_embedding_backend_unknown(self):
+        from app import llm
+        with patch.dict(sys.modules, {'sentence_transformers': self._fake_sentence_transformers()}):
+            with self.assertRaises(ValueError):
+                llm.load_embedding_model('tensorrt')
+
+    def test_embedding_backend_onnx_falls_back_to_torch(self):
+        from app import llm
+        fake = self._fake_sentence_transformers(fail_onnx=True)
+        with patch.dict(sys.modules, {'sentence_transformers': fake}), \
+                patch.dict(llm._model_cache, clear=True), \
+                patch('app.llm.EMBEDDING_BACKEND', 'onnx'), \
+                patch('app.llm.EMBEDDING_ONNX_DIR', '/nonexistent/onnx-model'):
+            model = llm.get_sentence_transformer_model()
+        self.assertIsNotNone(model)
+        last = fake.SentenceTransformer.call_args
+        self.assertEqual(last.args, (llm.EMBEDDING_MODEL,))
+        self.assertNotIn('backend', last.kwargs)
+
+    def test_embedding_backend_int8_exports_only_when_missing(self):
+        import tempfile
+        from pathlib import Path
+        from app import llm
+        fake = self._fake_sentence_transformers()
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch.dict(sys.modules, {'sentence_transformers': fake}), \
+                patch('app.llm.EMBEDDING_ONNX_DIR', tmp), \
+                patch('app.llm.EMBEDDING_QUANT_CONFIG', 'avx2'), \
+                patch('app.llm._onnx_session_options', return_value=None):
+            (Path(tmp) / 'onnx').mkdir()
+            (Path(tmp) / 'onnx' / 'model.onnx').write_bytes(b'')
+
+            llm.load_embedding_model('onnx-int8')
+            self.assertEqual(fake.export_dynamic_quantized_onnx_model.call_count, 1)
+            self.assertEqual(fake.SentenceTransformer.call_args.kwargs['model_kwargs']['file_name'],
+                             'onnx/model_qint8_avx2.onnx')
+
+            (Path(tmp) / 'onnx' / 'model_qint8_avx2.onnx').write_bytes(b'')
+            llm.load_embedding_model('onnx-int8')
+            self.assertEqual(fake.export_dynamic_quantized_onnx_model.call_count, 1)
+
     def test_ingest_usecase2_md(self):
         # Use the repository's usecase2.md as a text source and upsert into the memory vector store
         from app.vectorstore import ChromaClientWrapper
@@ -66,6 +476,29 @@ class BackendTests(unittest.TestCase):
         self.assertTrue(len(found) == 1)
         self.assertEqual(found[0]['count'], len(chunks))
 
+    def test_save_upload_stream(self):
+        import asyncio
+        import hashlib
+        import io
+        import tempfile
+        from pathlib import Path
+        from starlette.datastructures import UploadFile
+        from app.ingest import save_upload_stream, UploadTooLargeError
+
+        payload = b'%PDF-1.4 ' + b'x' * 5000
+        with tempfile.TemporaryDirectory() as tmp:
+            upload = UploadFile(file=io.BytesIO(payload), filename='doc.pdf')
+            path, size, sha = asyncio.run(save_upload_stream(upload, Path(tmp), 'doc.pdf', chunk_size=1024))
+            self.assertEqual(size, len(payload))
+            self.assertEqual(sha, hashlib.sha256(payload).hexdigest())
+            self.assertEqual(path.read_bytes(), payload)
+
+            # over the limit: rejected and no partial file left behind
+            upload = UploadFile(file=io.BytesIO(payload), filename='big.pdf')
+            with self.assertRaises(UploadTooLargeError):
+                asyncio.run(save_upload_stream(upload, Path(tmp), 'big.pdf', max_bytes=2048, chunk_size=1024))
+            self.assertEqual(sorted(os.listdir(tmp)), ['doc.pdf'])
+
 
 if __name__ == '__main__':
     unittest.main()